@@ -1,6 +1,24 @@
+import re
+from collections import defaultdict
+from functools import lru_cache
+from itertools import combinations
+
+# symbol kinds, compared instead of isinstance in the grammar passes
+TERMINAL = 0
+NONTERMINAL = 1
+EPSILON = 2
+
+# one rhs symbol: a char, then the number and primes that may follow a nonterminal
+_RHS_TOKEN = re.compile(r"(.)(\d?'*)", re.DOTALL)
+
 class Symbol:
+    __slots__ = ('value', '_hash')
+    kind = None
+
     def __init__(self, value):
         self.value = value
+        # symbols sit inside rule tuples and sets, hashed all the time
+        self._hash = hash(value)
 
     def __str__(self):
         return self.value
@@ -11,16 +29,23 @@ class Symbol:
         return self.value == other.value
     
     def __hash__(self):
-        return hash(self.value)
+        return self._hash
 
 class Terminal(Symbol):
-    pass
+    __slots__ = ()
+    kind = TERMINAL
 
 class Epsilon(Symbol):
+    __slots__ = ()
+    kind = EPSILON
+
     def __init__(self):
         super().__init__('ε')
 
 class Nonterminal(Symbol):
+    __slots__ = ()
+    kind = NONTERMINAL
+
     def __init__(self, value):
         if not value[0].isupper():
             raise ValueError("Nonterminal must start with uppercase letter")
@@ -29,9 +54,13 @@ class Nonterminal(Symbol):
         super().__init__(value)
 
 class GrammarRule:
+    __slots__ = ('lhs', 'rhs', 'rule_number', '_hash')
+
     def __init__(self, lhs, rhs, rule_number=None):
         self.lhs = lhs
-        self.rhs = rhs
+        # tuple so equality and hashing stay in C
+        self.rhs = tuple(rhs)
+        self._hash = hash((self.lhs, self.rhs))
         self.rule_number = rule_number
 
     def __str__(self):
@@ -42,16 +71,21 @@ class GrammarRule:
     def __eq__(self, other):
         if not isinstance(other, GrammarRule):
             return False
-        return (self.lhs == other.lhs and 
-                len(self.rhs) == len(other.rhs) and 
-                all(s1 == s2 for s1, s2 in zip(self.rhs, other.rhs)))
+        return self.lhs == other.lhs and self.rhs == other.rhs
     def __hash__(self):
-        return hash((self.lhs, tuple(self.rhs)))
+        return self._hash
 
 class Grammar:
     def __init__(self):
-        self.rules = set()
+        # list keeps rule order for iteration, set is only for dedup
+        self._rule_set = set()
+        self._rule_list = []
+        # rules sorted by number, built on demand and dropped when rules change
+        self._sorted_cache = None
         self._next_rule_number = 1
+        # symbol value -> small int id and back (see get_symbol_id)
+        self._intern = {}
+        self._by_id = []
 
     def add_rule(self, rule_str, position=None):
         parts = rule_str.split("->")
@@ -68,93 +102,117 @@ class Grammar:
             rhs = []  # empty list == epsilon rhs
         else:
             rhs = []
-            i = 0
             # no spaces allowed
             rhs_str = rhs_str.replace(" ", "")
-            while i < len(rhs_str):
-                if rhs_str[i].isupper():
-                    # nonterminal (nt)
-                    current_nt = rhs_str[i]
-                    i += 1
-                    # nt chars (number or prime)
-                    if i < len(rhs_str):
-                        next_char = rhs_str[i]
-                        if next_char.isdigit() or next_char == "'":
-                            current_nt += next_char
-                            i += 1
-                    rhs.append(Nonterminal(current_nt))
+            for char, suffix in _RHS_TOKEN.findall(rhs_str):
+                if char.isupper():
+                    # nonterminal (nt) with its number and/or primes
+                    rhs.append(Nonterminal(char + suffix))
                 else:
-                    # terminal (t)
-                    if rhs_str[i] == "'":
-                        # if ' is a part of previous nt
-                        if rhs and isinstance(rhs[-1], Nonterminal):
-                            rhs[-1] = Nonterminal(rhs[-1].value + "'")
-                        else:
-                            rhs.append(Terminal(rhs_str[i]))
-                    else:
-                        rhs.append(Terminal(rhs_str[i]))
-                    i += 1
+                    # terminal (t), what looked like nt chars are terminals too
+                    rhs.append(Terminal(char))
+                    for suffix_char in suffix:
+                        rhs.append(Terminal(suffix_char))
 
-        new_rule = GrammarRule(lhs, rhs)
-        if new_rule in self.rules:
-            return
         if position is None:
-            new_rule.rule_number = self._next_rule_number
-            self._next_rule_number += 1
-            self.rules.add(new_rule)
+            self.add_rule_obj(lhs, rhs)
         else:
+            new_rule = GrammarRule(lhs, rhs)
+            if new_rule in self._rule_set:
+                return
             if position < 1:
                 raise ValueError("Rule position must be 1 or greater")
             
             insert_index = position - 1
-            for rule in self.rules[insert_index:]:
+            for rule in self._rule_list[insert_index:]:
                 if rule.rule_number:
                     rule.rule_number += 1
             
             new_rule.rule_number = position
-            self.rules.add(new_rule)
-            self._next_rule_number = max(self._next_rule_number, len(self.rules) + 1)
+            self._rule_set.add(new_rule)
+            self._rule_list.insert(insert_index, new_rule)
+            self._sorted_cache = None
+            self._next_rule_number = max(self._next_rule_number, len(self._rule_list) + 1)
+
+    def add_rule_obj(self, lhs, rhs):
+        # add a rule from already built symbols, skips the string parsing of add_rule
+        new_rule = GrammarRule(lhs, rhs)
+        if new_rule in self._rule_set:
+            return
+        new_rule.rule_number = self._next_rule_number
+        self._next_rule_number += 1
+        self._append_rule(new_rule)
+
+    def _append_rule(self, new_rule):
+        # add an already built rule as is (no numbering)
+        if new_rule in self._rule_set:
+            return
+        self._rule_set.add(new_rule)
+        self._rule_list.append(new_rule)
+        self._sorted_cache = None
 
     def print_rules(self):
-        print("\n".join(str(rule) for rule in self.get_rules_list()))
+        print("\n".join(str(rule) for rule in self.get_sorted_rules()))
+
+    def get_sorted_rules(self):
+        if self._sorted_cache is None:
+            self._sorted_cache = sorted(self._rule_list, key=lambda x: x.rule_number if x.rule_number else float('inf'))
+        return self._sorted_cache
 
     def __getitem__(self, index):
-        return self.get_rules_list()[index]
+        return self._rule_list[index]
 
     def get_rules_list(self):
-        return sorted(list(self.rules), key=lambda x: x.rule_number if x.rule_number else float('inf'))
+        return self._rule_list
 
     def __iter__(self):
-        return iter(self.get_rules_list())
+        return iter(self._rule_list)
 
     def __len__(self):
-        return len(self.rules)
+        return len(self._rule_list)
+
+    def get_symbol_id(self, symbol):
+        # ints hash and compare cheaper than symbols, parser tables use these
+        if symbol.value not in self._intern:
+            self._intern[symbol.value] = len(self._by_id)
+            self._by_id.append(symbol)
+        return self._intern[symbol.value]
+
+    def get_symbol(self, symbol_id):
+        return self._by_id[symbol_id]
 
 def remove_nonproductive(grammar):
+    lhs_index = defaultdict(list)
+    for rule in grammar:
+        lhs_index[rule.lhs.value].append(rule)
+
     def find_productive_nonterminals():
         productive = set()
         changed = True
         
         while changed:
             changed = False
-            for rule in grammar:
+            for nt, rules in lhs_index.items():
                 # skip if LHS is known to be productive
-                if rule.lhs.value in productive:
+                if nt in productive:
                     continue
                 
-                # check if all symbols in RHS are either t or productive nt
-                all_productive = True
-                for symbol in rule.rhs:
-                    if isinstance(symbol, Nonterminal):
-                        if symbol.value not in productive:
-                            all_productive = False
-                            break
-                    # Terminals are always productive
-                
-                # if all RHS symbols productive, add LHS to productive set
-                if all_productive:
-                    productive.add(rule.lhs.value)
-                    changed = True
+                for rule in rules:
+                    # check if all symbols in RHS are either t or productive nt
+                    all_productive = True
+                    for symbol in rule.rhs:
+                        if symbol.kind == NONTERMINAL:
+                            if symbol.value not in productive:
+                                all_productive = False
+                                break
+                        # Terminals are always productive
+                    
+                    # if all RHS symbols productive, add LHS to productive set
+                    # and skip the rest of its rules
+                    if all_productive:
+                        productive.add(nt)
+                        changed = True
+                        break
                     
         return productive
     
@@ -170,50 +228,49 @@ def remove_nonproductive(grammar):
         if rule.lhs.value in productive_nts:
             all_rhs_productive = True
             for symbol in rule.rhs:
-                if isinstance(symbol, Nonterminal):
+                if symbol.kind == NONTERMINAL:
                     if symbol.value not in productive_nts:
                         all_rhs_productive = False
                         break
             
             if all_rhs_productive:
-                rule_str = f"{rule.lhs.value} -> {''.join(symbol.value for symbol in rule.rhs)}"
-                new_grammar.add_rule(rule_str)
+                new_grammar.add_rule_obj(rule.lhs, rule.rhs)
     
     return new_grammar
 
 def remove_unreachable(grammar, start_symbol='S'):
+    lhs_index = defaultdict(list)
+    for rule in grammar:
+        lhs_index[rule.lhs.value].append(rule)
+
     # set of reachable nonterminals with start symbol
     reachable = {Nonterminal(start_symbol)}
     
-    # sizes to detect when no new nt are added
-    old_size = 0
-    new_size = 1
-    
-    # while still finding new reachable nt
-    while old_size != new_size:
-        old_size = len(reachable)
-        
-        for rule in grammar:
-            if rule.lhs in reachable:
-                # add all nonterminals from RHS
-                for symbol in rule.rhs:
-                    if isinstance(symbol, Nonterminal):
-                        reachable.add(symbol)
-        
-        new_size = len(reachable)
+    # worklist of reachable nt whose rules are not scanned yet
+    worklist = [Nonterminal(start_symbol)]
+    while worklist:
+        nt = worklist.pop()
+        for rule in lhs_index.get(nt.value, ()):
+            # add all nonterminals from RHS
+            for symbol in rule.rhs:
+                if symbol.kind == NONTERMINAL and symbol not in reachable:
+                    reachable.add(symbol)
+                    worklist.append(symbol)
     
     # grammar with only reachable productions
     new_grammar = Grammar()
     # rules where LHS is reachable
     for rule in grammar:
         if rule.lhs in reachable:
-            rhs_str = ''.join(symbol.value for symbol in rule.rhs)
-            rule_str = f"{rule.lhs.value}->{rhs_str}"
-            new_grammar.add_rule(rule_str)
+            new_grammar.add_rule_obj(rule.lhs, rule.rhs)
     
     return new_grammar
 
 def remove_epsilon_rules(grammar, start_symbol):
+    lhs_index = defaultdict(list)
+    for rule in grammar:
+        lhs_index[rule.lhs.value].append(rule)
+
     # find direct epsilon producers (inappropriate movie joke)
     eps_producers = set()
     for rule in grammar:
@@ -225,20 +282,22 @@ def remove_epsilon_rules(grammar, start_symbol):
     changed = True
     while changed:
         changed = False
-        for rule in grammar:
-            if rule.lhs not in eps_producers:
-                # check if all symbols in RHS are in eps_producers
-                if rule.rhs and all(symbol in eps_producers for symbol in rule.rhs):
-                    eps_producers.add(rule.lhs)
-                    changed = True
+        for rules in lhs_index.values():
+            lhs = rules[0].lhs
+            if lhs in eps_producers:
+                continue
+            # check if all symbols in RHS of some rule are in eps_producers
+            if any(rule.rhs and all(symbol in eps_producers for symbol in rule.rhs) for rule in rules):
+                eps_producers.add(lhs)
+                changed = True
     
     new_grammar = Grammar()
     
     # if start symbol in eps_producers
     if start_symbol in eps_producers:
         new_start = Nonterminal(start_symbol.value + "1")
-        new_grammar.add_rule(f"{new_start} -> {start_symbol}")
-        new_grammar.add_rule(f"{new_start} -> ε")
+        new_grammar.add_rule_obj(new_start, [start_symbol])
+        new_grammar.add_rule_obj(new_start, [])  # epsilon
         start_symbol = new_start
     
     for rule in grammar:
@@ -254,28 +313,21 @@ def remove_epsilon_rules(grammar, start_symbol):
                 
         if not eps_positions:
             # if no eps-producers in RHS, keep the rule as is
-            new_grammar.add_rule(f"{rule.lhs} -> {''.join(str(s) for s in rule.rhs)}")
+            new_grammar.add_rule_obj(rule.lhs, rule.rhs)
             continue
             
-        # generate all combinations using binary masks
-        n_eps = len(eps_positions)
-        for mask in range(2**n_eps):
-            new_rhs = []
-            skip_positions = set()
-            
-            # convert mask to binary and determine which eps-producers to skip
-            for i in range(n_eps):
-                if not (mask & (1 << i)):
-                    skip_positions.add(eps_positions[i])
-                    
-            # new RHS with Mask
-            for i, symbol in enumerate(rule.rhs):
-                if i not in skip_positions:
-                    new_rhs.append(symbol)
-                    
-            # add rule if RHS not empty
-            if new_rhs:
-                new_grammar.add_rule(f"{rule.lhs} -> {''.join(str(s) for s in new_rhs)}")
+        # generate every subset of eps-producers to skip, smallest first.
+        # different subsets often give the same RHS (A -> BB), add each RHS once
+        seen = set()
+        for n_skip in range(len(eps_positions) + 1):
+            for skipped in combinations(eps_positions, n_skip):
+                skip_positions = frozenset(skipped)
+                new_rhs = tuple(symbol for i, symbol in enumerate(rule.rhs) if i not in skip_positions)
+
+                # add rule if RHS not empty
+                if new_rhs and new_rhs not in seen:
+                    seen.add(new_rhs)
+                    new_grammar.add_rule_obj(rule.lhs, new_rhs)
     
     # new_grammar.rules = sorted(list(set(new_grammar.rules)), key=lambda x: x.rule_number if x.rule_number else float('inf'))
 
@@ -283,46 +335,42 @@ def remove_epsilon_rules(grammar, start_symbol):
 
 def eliminate_chain_rules(grammar):
     new_grammar = Grammar()
+
+    # rules by lhs and direct chain rules A -> B as A -> [B, ...]
+    rules_by_lhs = defaultdict(list)
+    chain_successors = defaultdict(list)
+    for rule in grammar:
+        rules_by_lhs[rule.lhs].append(rule)
+        if len(rule.rhs) == 1 and rule.rhs[0].kind == NONTERMINAL:
+            chain_successors[rule.lhs].append(rule.rhs[0])
     
     # function to find CHAIN(A) for a nonterminal A
-    def find_chain(nt, visited=None):
-        if visited is None:
-            visited = set()
-        
-        if nt in visited:
-            return set()
-            
+    @lru_cache(maxsize=None)
+    def find_chain(nt):
         chain = {nt}
-        visited.add(nt)
-        
-        # find all direct chain rules for this nt
-        for rule in grammar.rules:
-            if rule.lhs == nt and len(rule.rhs) == 1 and isinstance(rule.rhs[0], Nonterminal):
-                chain.update(find_chain(rule.rhs[0], visited))
-                
+        stack = [nt]
+        while stack:
+            current = stack.pop()
+            for successor in chain_successors.get(current, ()):
+                if successor not in chain:
+                    chain.add(successor)
+                    stack.append(successor)
         return chain
 
-    processed_rules = set()
-    for rule in grammar.rules:
-        nt = rule.lhs
+    # each lhs once, add_rule_obj drops rules that are already there
+    for nt in rules_by_lhs:
         chain = find_chain(nt)
         
         # for each nt in the chain
         for b in chain:
             # look for non-chain rules with B(any nt) on the left side
-            for rule_b in grammar.rules:
-                if rule_b.lhs == b:
-                    # skip chain rules
-                    if len(rule_b.rhs) == 1 and isinstance(rule_b.rhs[0], Nonterminal):
-                        continue
-                        
-                    # new rule: A -> γ where B -> γ is a non-chain rule
-                    new_rule_str = f"{nt} -> {''.join(str(symbol) for symbol in rule_b.rhs)}"
+            for rule_b in rules_by_lhs.get(b, ()):
+                # skip chain rules
+                if len(rule_b.rhs) == 1 and rule_b.rhs[0].kind == NONTERMINAL:
+                    continue
                     
-                    # add only if not already processed
-                    if new_rule_str not in processed_rules:
-                        new_grammar.add_rule(new_rule_str)
-                        processed_rules.add(new_rule_str)
+                # new rule: A -> γ where B -> γ is a non-chain rule
+                new_grammar.add_rule_obj(nt, rule_b.rhs)
 
     return new_grammar
 
@@ -338,7 +386,7 @@ def to_chomsky_normal_form(grammar):
             new_nt = f"X{next_nt_number}"
             next_nt_number += 1
             # check if the nt already in use
-            if not any(rule.lhs.value == new_nt for rule in grammar.rules):
+            if not any(rule.lhs.value == new_nt for rule in grammar):
                 return Nonterminal(new_nt)
 
     # handle t within longer rules
@@ -346,12 +394,12 @@ def to_chomsky_normal_form(grammar):
         if len(rule.rhs) >= 2:
             new_rhs = []
             for symbol in rule.rhs:
-                if isinstance(symbol, Terminal):
+                if symbol.kind == TERMINAL:
                     if symbol.value not in terminal_rules:
                         new_nt = get_new_nonterminal()
                         terminal_rules[symbol.value] = new_nt
                         # new rule for t
-                        cnf.add_rule(f"{new_nt.value} -> {symbol.value}")
+                        cnf.add_rule_obj(new_nt, [symbol])
                     new_rhs.append(terminal_rules[symbol.value])
                 else:
                     new_rhs.append(symbol)
@@ -359,7 +407,7 @@ def to_chomsky_normal_form(grammar):
         else:
             # keep single-symbol rules as they are
             new_rule = GrammarRule(rule.lhs, rule.rhs)
-            cnf.rules.add(new_rule)
+            cnf._append_rule(new_rule)
 
     # break down rules with more than 2 nt
     for original_rule, (lhs, rhs) in new_rules.items():
@@ -372,22 +420,71 @@ def to_chomsky_normal_form(grammar):
                 new_nt,
                 [current_rhs[-2], current_rhs[-1]]
             )
-            cnf.rules.add(new_rule)
+            cnf._append_rule(new_rule)
             # replace last two symbols with new nt
             current_rhs = current_rhs[:-2] + [new_nt]
         
         if current_rhs: # add final rule
             final_rule = GrammarRule(lhs, current_rhs)
-            cnf.rules.add(final_rule)
+            cnf._append_rule(final_rule)
 
     # reassign rule numbers
-    sorted_rules = sorted(cnf.rules, key=lambda x: x.rule_number if x.rule_number else float('inf'))
-    for i, rule in enumerate(sorted_rules, 1):
+    cnf._rule_list.sort(key=lambda x: x.rule_number if x.rule_number else float('inf'))
+    for i, rule in enumerate(cnf._rule_list, 1):
         rule.rule_number = i
-    cnf._next_rule_number = len(cnf.rules) + 1
+    cnf._sorted_cache = None
+    cnf._next_rule_number = len(cnf) + 1
 
     return cnf
 
+def iter_mask(mask):
+    # ids of the set bits in a cell bitmask, lowest first
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+def fill_recognition_table(word, terminal_masks, combine_masks):
+    # cells[i][j] = bitmask of nonterminals deriving word[i:i + j].
+    # plain nested lists of ints, no tuple keys or parser state in the loop
+    n = len(word)
+    cells = [[0] * (n + 1) for _ in range(n)]
+
+    # lengths of the filled cells that start / end at each position,
+    # so only split points with both halves filled are visited
+    starts_at = [[] for _ in range(n + 1)]
+    ends_at = [[] for _ in range(n + 1)]
+
+    # j = 1
+    for i in range(n):
+        if word[i] in terminal_masks:
+            cells[i][1] = terminal_masks[word[i]]
+            starts_at[i].append(1)
+            ends_at[i + 1].append(1)
+
+    # fill table (j > 1)
+    for j in range(2, n + 1):
+        for i in range(n - j + 1):
+            # walk whichever side has fewer filled cells
+            if len(starts_at[i]) <= len(ends_at[i + j]):
+                splits = starts_at[i]
+            else:
+                splits = [j - length for length in ends_at[i + j] if length < j]
+            row = cells[i]
+            cell = 0
+            for k in splits:
+                left_mask = row[k]
+                right_mask = cells[i + k][j - k]
+                if not left_mask or not right_mask:
+                    continue
+                cell |= combine_masks(left_mask, right_mask)
+            if cell:
+                row[j] = cell
+                starts_at[i].append(j)
+                ends_at[i + j].append(j)
+
+    return cells
+
 class CYKParser:
     def __init__(self, grammar):
         # get start symbol from first rule
@@ -403,42 +500,102 @@ class CYKParser:
         else:
             self.grammar = grammar
         self.recognition_table = {}
+
+        # nonterminals are stored as int ids in the table and indexes below
+        self.start_id = self.grammar.get_symbol_id(self.start_symbol) if self.start_symbol else None
+
+        # index rules by rhs so parse doesn't have to scan the whole grammar
+        # (B, C) -> [(A, rule_number), ...] for A -> B C
+        self.binary_index = defaultdict(list)
+        # a -> [(A, rule_number), ...] for A -> a
+        self.terminal_index = defaultdict(list)
+        for rule in self.grammar:
+            lhs_id = self.grammar.get_symbol_id(rule.lhs)
+            if len(rule.rhs) == 2:
+                rhs_ids = (self.grammar.get_symbol_id(rule.rhs[0]), self.grammar.get_symbol_id(rule.rhs[1]))
+                self.binary_index[rhs_ids].append((lhs_id, rule.rule_number))
+            elif len(rule.rhs) == 1 and rule.rhs[0].kind == TERMINAL:
+                self.terminal_index[rule.rhs[0].value].append((lhs_id, rule.rule_number))
+        # (A, a) -> rule_number of A -> a, for the leaves of a derivation
+        self.term_rule_by = {}
+        for terminal, entries in self.terminal_index.items():
+            for nt, rule_number in entries:
+                self.term_rule_by.setdefault((nt, terminal), rule_number)
+
+        # table cells are bitmasks of nonterminal ids, so the same indexes as masks:
+        # a -> mask of every A with A -> a
+        self.terminal_masks = {}
+        for terminal, entries in self.terminal_index.items():
+            for nt, _ in entries:
+                self.terminal_masks[terminal] = self.terminal_masks.get(terminal, 0) | (1 << nt)
+        # B -> [(mask of every C with A -> B C, A bit), ...]
+        right_masks = defaultdict(int)
+        for (left_nt, right_nt), entries in self.binary_index.items():
+            for nt, _ in entries:
+                right_masks[(left_nt, nt)] |= 1 << right_nt
+        self.pair_table = defaultdict(list)
+        for (left_nt, nt), right_mask in right_masks.items():
+            self.pair_table[left_nt].append((right_mask, 1 << nt))
+        # mask of every B that starts some A -> B C
+        self.left_nts = 0
+        for left_nt in self.pair_table:
+            self.left_nts |= 1 << left_nt
+        # (left mask, right mask) -> mask of every A with A -> B C, B in left, C in right.
+        # depends on the grammar only, so it is kept between parses
+        self.combine_cache = {}
+        # (i, j) -> {(A, rule_number), ...}, filled on demand by print_table
+        self.cell_rules = {}
         
     def parse(self, word):
         n = len(word)
         self.recognition_table = {}
+        self.cell_rules = {}
         
-        # j = 1
+        cells = fill_recognition_table(word, self.terminal_masks, self.combine_masks)
         for i in range(n):
-            for rule in self.grammar:
-                if len(rule.rhs) == 1 and isinstance(rule.rhs[0], Terminal) and rule.rhs[0].value == word[i]:
-                    self.add_to_table(i, 1, (rule.lhs, rule.rule_number))
-        
-        # fill table (j > 1)
-        for j in range(2, n + 1):
-            for i in range(n - j + 1):
-                for k in range(1, j):
-                    for rule in self.grammar:
-                        if len(rule.rhs) == 2:
-                            if (i, k) in self.recognition_table and \
-                            (i + k, j - k) in self.recognition_table:
-                                for left_nt, _ in self.recognition_table[(i, k)]:
-                                    for right_nt, _ in self.recognition_table[(i + k, j - k)]:
-                                        if rule.rhs[0] == left_nt and rule.rhs[1] == right_nt:
-                                            self.add_to_table(i, j, (rule.lhs, rule.rule_number))
+            for j in range(1, n - i + 1):
+                if cells[i][j]:
+                    self.add_to_table(i, j, cells[i][j])
         
         # total recall
-        if (0, n) in self.recognition_table and self.start_symbol:
-            for nt, _ in self.recognition_table[(0, n)]:
-                if nt == self.start_symbol:
-                    rule_numbers = self.get_derivation_rules(word)
-                    return True, rule_numbers
+        if self.start_symbol and self.recognition_table.get((0, n), 0) >> self.start_id & 1:
+            rule_numbers = self.get_derivation_rules(word)
+            return True, rule_numbers
         return False, None
 
-    def add_to_table(self, i, j, nt_rule):
-        if (i, j) not in self.recognition_table:
-            self.recognition_table[(i, j)] = set()
-        self.recognition_table[(i, j)].add(nt_rule)
+    def combine_masks(self, left_mask, right_mask):
+        # whole-cell product of two cells, the same cell pairs repeat a lot so it's cached
+        key = (left_mask, right_mask)
+        if key not in self.combine_cache:
+            result = 0
+            for left_nt in iter_mask(left_mask & self.left_nts):
+                for right_nts, nt_bit in self.pair_table[left_nt]:
+                    if right_mask & right_nts:
+                        result |= nt_bit
+            self.combine_cache[key] = result
+        return self.combine_cache[key]
+
+    def add_to_table(self, i, j, nt_mask):
+        self.recognition_table[(i, j)] = self.recognition_table.get((i, j), 0) | nt_mask
+
+    def get_cell_rules(self, word, i, j):
+        # every (nt, rule_number) that puts nt into cell (i, j)
+        if (i, j) in self.cell_rules:
+            return self.cell_rules[(i, j)]
+        rules = set()
+        if j == 1:
+            for nt, rule_number in self.terminal_index.get(word[i], ()):
+                rules.add((nt, rule_number))
+        else:
+            for k in range(1, j):
+                left_mask = self.recognition_table.get((i, k), 0)
+                right_mask = self.recognition_table.get((i + k, j - k), 0)
+                for left_nt in iter_mask(left_mask):
+                    for right_nt in iter_mask(right_mask):
+                        for nt, rule_number in self.binary_index.get((left_nt, right_nt), ()):
+                            rules.add((nt, rule_number))
+        self.cell_rules[(i, j)] = rules
+        return self.cell_rules[(i, j)]
             
     def get_derivation_rules(self, word):
         n = len(word)
@@ -446,32 +603,28 @@ class CYKParser:
             return []
         
         # find the final rule in parsing (start symbol in pos (0, len(word))
-        start_rule_number = None
-        for nt, rule_number in self.recognition_table[(0, n)]:
-            if nt == self.start_symbol:
-                start_rule_number = rule_number
-                break
-        if not start_rule_number:
+        if not self.recognition_table[(0, n)] >> self.start_id & 1:
             return []
         
+        # same (i, j, nt) can be reached through different splits, so memoize.
+        # tuples because cached results are shared
+        @lru_cache(maxsize=None)
         def _trace_rules(i, j, current_nt):
             if j == 1:
-                for rule in self.grammar:
-                    if len(rule.rhs) == 1 and isinstance(rule.rhs[0], Terminal) and rule.lhs == current_nt and rule.rhs[0].value == word[i]:
-                        return [rule.rule_number]
-                return []
+                if (current_nt, word[i]) in self.term_rule_by:
+                    return (self.term_rule_by[(current_nt, word[i])],)
+                return ()
             
             for k in range(1, j):
                 if (i, k) in self.recognition_table and (i + k, j - k) in self.recognition_table:
-                    for left_nt, left_rule_number in self.recognition_table[(i, k)]:
-                        for right_nt, right_rule_number in self.recognition_table[(i + k, j - k)]:
-                            for rule in self.grammar:
-                                if rule.lhs == current_nt and len(rule.rhs) == 2 and rule.rhs[0] == left_nt and rule.rhs[1] == right_nt:
-                                    return [rule.rule_number] + _trace_rules(i, k, left_nt) + _trace_rules(i + k, j - k, right_nt)
-            return []
+                    for left_nt in iter_mask(self.recognition_table[(i, k)]):
+                        for right_nt in iter_mask(self.recognition_table[(i + k, j - k)]):
+                            for nt, rule_number in self.binary_index.get((left_nt, right_nt), ()):
+                                if nt == current_nt:
+                                    return (rule_number,) + _trace_rules(i, k, left_nt) + _trace_rules(i + k, j - k, right_nt)
+            return ()
         
-        return _trace_rules(0, n, self.start_symbol)
-        # return [start_rule_number] + _trace_rules(0, n, self.start_symbol)
+        return list(_trace_rules(0, n, self.start_id))
 
     def print_table(self, word):
         n = len(word)
@@ -492,7 +645,7 @@ class CYKParser:
             for j in range(1, n + 1):
                 cell_values = []
                 if (i, j) in self.recognition_table:
-                    cell_values = [f"{nt.value}, {rule_num}" for nt, rule_num in self.recognition_table[(i, j)]]
+                    cell_values = [f"{self.grammar.get_symbol(nt).value}, {rule_num}" for nt, rule_num in self.get_cell_rules(word, i, j)]
                 max_width = len(' ; '.join(cell_values))
                 column_widths[j] = max(column_widths[j], max_width)
 
@@ -511,7 +664,7 @@ class CYKParser:
             for j in range(1, n + 1):
                 cell_values = []
                 if (i, j) in self.recognition_table:
-                    cell_values = [f"{nt.value}, {rule_num}" for nt, rule_num in self.recognition_table[(i, j)]]
+                    cell_values = [f"{self.grammar.get_symbol(nt).value}, {rule_num}" for nt, rule_num in self.get_cell_rules(word, i, j)]
                 row.append(f" {(' ; '.join(cell_values)).center(column_widths[j])} |")
             print("".join(row))
 
@@ -547,7 +700,7 @@ def main():
     # grammar.add_rule("A -> a")
     # grammar.add_rule("A -> b")
 
-    if not grammar.rules:
+    if not grammar:
         print("Вы не ввели ни одного правила. До свидания")
         return
     
@@ -1,9 +1,19 @@
+from collections import defaultdict
+
 class Rule:
+    # lots of these per parse, slots keep them small
+    __slots__ = ('left', 'right', 'dot_position', 'start_pos', '_hash', '_is_complete', '_next_symbol')
+
     def __init__(self, left, right, dot_position, start_pos):
         self.left = left
         self.right = right
         self.dot_position = dot_position
         self.start_pos = start_pos
+        # rules are immutable and hashed on every chart insert
+        self._hash = hash((left, right, dot_position, start_pos))
+        # dot in the end / symbol after the dot, asked for on every step
+        self._is_complete = dot_position >= len(right)
+        self._next_symbol = None if self._is_complete else right[dot_position]
     
     def __eq__(self, other):
         return (self.left == other.left and 
@@ -12,7 +22,7 @@ class Rule:
                 self.start_pos == other.start_pos)
     
     def __hash__(self):
-        return hash((self.left, self.right, self.dot_position, self.start_pos))
+        return self._hash
     
     def __str__(self):
         right_part = list(self.right)
@@ -21,13 +31,11 @@ class Rule:
 
     def is_complete(self):
         # check for dot in the end
-        return self.dot_position >= len(self.right)
+        return self._is_complete
 
     def next_symbol(self):
         # next symbol after dot
-        if self.is_complete():
-            return None
-        return self.right[self.dot_position]
+        return self._next_symbol
 
     def advance_dot(self):
         # new rule with moved dot
@@ -39,6 +47,19 @@ class EarleyParser:
         self.grammar = grammar
         # set of rules(structures) for each situation
         self.chart = []
+        # same rules in insertion order, processed as a worklist
+        self.chart_list = []
+        # (position, nonterminal) completed without consuming input at position
+        self.empty_completions = set()
+        # (position, nonterminal) -> states at position with the dot before nonterminal
+        self.waiting_for = defaultdict(list)
+
+    def add_state(self, state, position):
+        if state not in self.chart[position]:
+            self.chart[position].add(state)
+            self.chart_list[position].append(state)
+            if not state.is_complete():
+                self.waiting_for[(position, state.next_symbol())].append(state)
         
     def predict(self, state, position):
         next_sym = state.next_symbol()
@@ -46,19 +67,23 @@ class EarleyParser:
             new_states = [Rule(next_sym, rhs, 0, position) 
                          for rhs in self.grammar[next_sym]]
             for new_state in new_states:
-                self.chart[position].add(new_state)
+                self.add_state(new_state, position)
+            # next_sym already completed here (nullable), complete() ran before this state existed
+            if (position, next_sym) in self.empty_completions:
+                self.add_state(state.advance_dot(), position)
 
     def scan(self, state, position, input_string):
         if position < len(input_string):
             next_sym = state.next_symbol()
             if next_sym == input_string[position]:
-                self.chart[position + 1].add(state.advance_dot())
+                self.add_state(state.advance_dot(), position + 1)
 
     def complete(self, state, position):
         if state.is_complete():
-            for s in list(self.chart[state.start_pos]):
-                if not s.is_complete() and s.next_symbol() == state.left:
-                    self.chart[position].add(s.advance_dot())
+            if state.start_pos == position:
+                self.empty_completions.add((position, state.left))
+            for s in self.waiting_for.get((state.start_pos, state.left), ()):
+                self.add_state(s.advance_dot(), position)
 
     def parse(self, input_string, start_symbol):
         """
@@ -66,27 +91,30 @@ class EarleyParser:
         True, если строка принадлежит языку
         """
         self.chart = [set() for _ in range(len(input_string) + 1)]
+        self.chart_list = [[] for _ in range(len(input_string) + 1)]
+        self.empty_completions = set()
+        self.waiting_for = defaultdict(list)
         
         # grammar expansion
         initial_rule = Rule('S1', (start_symbol,), 0, 0)
-        self.chart[0].add(initial_rule)
+        self.add_state(initial_rule, 0)
         
         # iterationg through situations
         for i in range(len(input_string) + 1):
-            while True:
-                chart_size = len(self.chart[i])
-                for state in list(self.chart[i]):
-                    if not state.is_complete():
-                        next_sym = state.next_symbol()
-                        if next_sym in self.grammar:
-                            self.predict(state, i)
-                        else:
-                            self.scan(state, i, input_string)
+            # every state is processed once, new ones are appended behind the index
+            states = self.chart_list[i]
+            index = 0
+            while index < len(states):
+                state = states[index]
+                index += 1
+                if not state.is_complete():
+                    next_sym = state.next_symbol()
+                    if next_sym in self.grammar:
+                        self.predict(state, i)
                     else:
-                        self.complete(state, i)
-                
-                if len(self.chart[i]) == chart_size:
-                    break
+                        self.scan(state, i, input_string)
+                else:
+                    self.complete(state, i)
             
             # printing situations
             if len(self.chart[i]) == 0 and len(self.chart[i-1]) != 0: